@@ -2,24 +2,67 @@
 from __future__ import annotations
 
 import argparse
-import json
+import hashlib
 import logging
+import os
+import pickle
 import sys
 import uuid
+from dataclasses import astuple, dataclass
 from pathlib import Path
-from typing import Dict, Iterable, List, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
+import ijson
 from qdrant_client import QdrantClient, models
-from fastembed import TextEmbedding
+from fastembed import SparseTextEmbedding, TextEmbedding
 
 
 DEFAULT_EMBED_DIM = 768
 DEFAULT_MODEL = "jinaai/jina-embeddings-v2-base-en"
+SPARSE_MODEL = "Qdrant/bm25"
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_PARALLEL = max(1, (os.cpu_count() or 2) // 2)
+DEFAULT_INDEXING_THRESHOLD = 20_000
+GPU_EMBED_BATCH_SIZE = 512
+DEFAULT_GRPC_PORT = 6334
+CLIENT_TIMEOUT = 120
+# Large upload batches can exceed gRPC's 4MB default message size
+GRPC_OPTIONS = {
+    "grpc.max_send_message_length": 64 * 1024 * 1024,
+    "grpc.max_receive_message_length": 64 * 1024 * 1024,
+}
+
+ONNX_PROVIDERS = {
+    "cpu": ["CPUExecutionProvider"],
+    "cuda": ["CUDAExecutionProvider"],
+}
+
+
+@dataclass(slots=True, frozen=True)
+class QARecord:
+    channel: Optional[str]
+    thread_ts: str
+    asked_by: Optional[str]
+    answered_by: Optional[str]
+    question: str
+    answer: str
+
+
+_NAMESPACE_URL_BYTES = uuid.NAMESPACE_URL.bytes
+
+
+def qdrant_point_id(name: str, _sha1=hashlib.sha1, _ns=_NAMESPACE_URL_BYTES) -> str:
+    """
+    Deterministic UUIDv5 for a given name string.
 
-
-def qdrant_point_id(name: str) -> str:
-    """Deterministic UUIDv5 for a given name string."""
-    return str(uuid.uuid5(uuid.NAMESPACE_URL, name))
+    Equivalent to str(uuid.uuid5(uuid.NAMESPACE_URL, name)) but hashes the
+    precomputed namespace bytes directly and sets the version/variant bits
+    by hand, skipping uuid's argument handling on this per-record path.
+    """
+    digest = bytearray(_sha1(_ns + name.encode()).digest()[:16])
+    digest[6] = (digest[6] & 0x0F) | 0x50
+    digest[8] = (digest[8] & 0x3F) | 0x80
+    return str(uuid.UUID(bytes=bytes(digest)))
 
 def create_qdrant_collection(
     client: QdrantClient,
@@ -76,23 +119,30 @@ def ensure_collection(
   
 
 
-    logging.info("Creating payload index on 'channel'...")
-    client.create_payload_index(
-        collection_name=collection_name,
-        field_name="channel",
-        field_schema="keyword",
-    )
+    for field_name in ("channel", "thread_ts"):
+        logging.info("Creating payload index on '%s'...", field_name)
+        client.create_payload_index(
+            collection_name=collection_name,
+            field_name=field_name,
+            field_schema="keyword",
+        )
 
 
-def load_data(json_path: Path) -> List[Dict]:
-    with json_path.open("r", encoding="utf-8") as f:
-        data = json.load(f)
-    if not isinstance(data, list):
-        raise ValueError("Top-level JSON must be a list of thread objects.")
-    return data
+def iter_threads(json_path: Path) -> Iterable[Dict]:
+    """Stream thread objects from the top-level JSON list one at a time."""
+    with json_path.open("rb") as f:
+        # Check the first non-whitespace byte, then rewind so ijson parses the raw file
+        # (its C backend is only used when it reads the file itself)
+        first = f.read(1)
+        while first and first in b" \t\r\n":
+            first = f.read(1)
+        if first != b"[":
+            raise ValueError("Top-level JSON must be a list of thread objects.")
+        f.seek(0)
+        yield from ijson.items(f, "item", use_float=True)
 
 
-def iter_records(data: List[Dict]) -> Iterable[Tuple[str, Dict]]:
+def iter_records(data: Iterable[Dict]) -> Iterable[Tuple[str, QARecord]]:
     """
     Yield (deterministic_id, record) for each QA entry in the dataset.
 
@@ -107,94 +157,249 @@ def iter_records(data: List[Dict]) -> Iterable[Tuple[str, Dict]]:
         for i, qa in enumerate(qas):
             name = f"{i}{thread_ts_nodot}"
             point_id = qdrant_point_id(name)
-            record = {
-                "channel": thread.get("channel"),
-                "thread_ts": thread_ts,
-                "asked_by": qa.get("asked_by"),
-                "answered_by": qa.get("answered_by"),
-                "question": qa.get("question", ""),
-                "answer": qa.get("answer", ""),
-            }
+            record = QARecord(
+                channel=thread.get("channel"),
+                thread_ts=thread_ts,
+                asked_by=qa.get("asked_by"),
+                answered_by=qa.get("answered_by"),
+                question=qa.get("question", ""),
+                answer=qa.get("answer", ""),
+            )
             yield point_id, record
 
 
-def concatenate_text(record: Dict) -> str:
+def load_records(json_path: Path, use_cache: bool = True) -> List[Tuple[str, QARecord]]:
+    """
+    Flatten the input file into (id, record) pairs.
+
+    The result is pickled next to the input (<file>.records.pkl) together with
+    the source mtime and size; later runs reuse it while the source is unchanged.
+    Records are stored as plain tuples so the cache does not depend on how this
+    module was imported.
+    """
+    stat = json_path.stat()
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cache_path = json_path.with_name(json_path.name + ".records.pkl")
+
+    if use_cache and cache_path.exists():
+        try:
+            with cache_path.open("rb") as f:
+                cached_signature, rows = pickle.load(f)
+            if cached_signature == signature:
+                logging.info("Loaded %d records from cache %s", len(rows), cache_path)
+                return [(pid, QARecord(*fields)) for pid, fields in rows]
+        except Exception as e:
+            logging.warning("Ignoring unreadable record cache %s: %s", cache_path, e)
+
+    pairs = list(iter_records(iter_threads(json_path)))
+
+    if use_cache:
+        rows = [(pid, astuple(rec)) for pid, rec in pairs]
+        try:
+            with cache_path.open("wb") as f:
+                pickle.dump((signature, rows), f, protocol=5)
+        except OSError as e:
+            logging.warning("Could not write record cache %s: %s", cache_path, e)
+    return pairs
+
+
+def concatenate_text(record: QARecord) -> str:
     """Combine question + answer for embedding."""
-    return f"{record.get('question','')}\n{record.get('answer','')}".strip()
+    return f"{record.question}\n{record.answer}".strip()
+
+
+def sort_by_length(records: List[Tuple[str, QARecord]]) -> List[Tuple[str, QARecord]]:
+    """
+    Order records by token count so each embedding batch holds texts of similar length.
+
+    fastembed pads every batch to its longest text; grouping similar lengths
+    keeps padding (and wasted compute) small. Points carry their own IDs, so
+    upload order does not matter.
+    """
+    lengths = [len(concatenate_text(rec).split()) for _, rec in records]
+    order = sorted(range(len(records)), key=lengths.__getitem__)
+    return [records[i] for i in order]
 
 
-def fetch_existing_ids(client: QdrantClient, collection_name: str) -> set:
-    """Scroll through the collection and collect all existing point IDs."""
-    logging.info("Fetching existing IDs from collection '%s' (this may take a while)...", collection_name)
+def fetch_existing_ids(
+    client: QdrantClient,
+    collection_name: str,
+    thread_ts_values: Iterable[str],
+    chunk_size: int = 1_000,
+) -> set:
+    """
+    Collect IDs of points whose thread_ts is among the input threads.
+
+    Filtering on the indexed thread_ts payload lets the server return only
+    points belonging to incoming threads instead of the whole collection.
+    """
+    ts_list = sorted(set(thread_ts_values))
+    logging.info("Checking %d threads against collection '%s'...", len(ts_list), collection_name)
     existing_ids = set()
-    next_page = None
-    while True:
-        result, next_page = client.scroll(
-            collection_name=collection_name,
-            with_payload=False,
-            with_vectors=False,
-            limit=10_000,
-            offset=next_page,
+    for start in range(0, len(ts_list), chunk_size):
+        scroll_filter = models.Filter(
+            must=[
+                models.FieldCondition(
+                    key="thread_ts",
+                    match=models.MatchAny(any=ts_list[start:start + chunk_size]),
+                )
+            ]
         )
-        for pt in result:
-            existing_ids.add(str(pt.id))
-        if not next_page or not result:
-            break
+        next_page = None
+        while True:
+            result, next_page = client.scroll(
+                collection_name=collection_name,
+                scroll_filter=scroll_filter,
+                with_payload=False,
+                with_vectors=False,
+                limit=10_000,
+                offset=next_page,
+            )
+            existing_ids.update(str(pt.id) for pt in result)
+            if not next_page or not result:
+                break
     logging.info("Found %d existing IDs.", len(existing_ids))
     return existing_ids
 
 
-# def embed_texts(
-#     embedder: TextEmbedding,
-#     texts: List[str],
-# ) -> List[List[float]]:
-#     """Compute embeddings for a batch of texts."""
-#     # fastembed returns an iterator; convert to list of vectors
-#     return [vec for vec in embedder.embed(texts)]
-
-
-def upsert_points(
-    client: QdrantClient,
-    collection_name: str,
+def build_points(
     mode : str,
-    batch: List[Tuple[str, Dict]],
-    model_handle :str
-) -> None:
-    """Upsert a batch of points into Qdrant."""
+    batch: List[Tuple[str, QARecord]],
+    dense_model: TextEmbedding | None = None,
+    sparse_model: SparseTextEmbedding | None = None,
+) -> List[models.PointStruct]:
+    """Embed a batch client-side and build the points to upsert."""
     m = mode.lower().strip()
 
     if not batch:
-        return
+        return []
+    texts = [concatenate_text(record) for _, record in batch]
+
+    # fastembed yields one vector per text; embed the whole batch in one pass
+    dense_vecs = []
+    if m in {"dense", "hybrid"}:
+        dense_vecs = list(dense_model.embed(texts, batch_size=len(texts)))
+    sparse_vecs = []
+    if m in {"sparse", "hybrid"}:
+        sparse_vecs = list(sparse_model.embed(texts, batch_size=len(texts)))
+
     points = []
-    for pid, record in batch:
+    for i, (pid, record) in enumerate(batch):
         vector = {}
-        text=concatenate_text(record)
-        if m in {"dense", "hybrid"}:
-            vector["dense"] = models.Document(
-                text=text,
-                model=model_handle,  
-            )
-        if m in {"sparse", "hybrid"}:
-            vector["sparse"] = models.Document(
-                text=text,
-                model="Qdrant/bm25",  
+        if dense_vecs:
+            vector["dense"] = dense_vecs[i].tolist()
+        if sparse_vecs:
+            vector["sparse"] = models.SparseVector(
+                indices=sparse_vecs[i].indices.tolist(),
+                values=sparse_vecs[i].values.tolist(),
             )
         points.append(
             models.PointStruct(
                 id=pid,
                 vector=vector, 
-                payload={
-                    "channel": record.get("channel"),
-                    "thread_ts": record.get("thread_ts"),
-                    "asked_by": record.get("asked_by"),
-                    "answered_by": record.get("answered_by"),
-                    "question": record.get("question"),
-                    "answer": record.get("answer"),
-                },
+                payload={field: getattr(record, field) for field in QARecord.__slots__},
             )
         )
+    return points
+
+
+def iter_points(
+    mode: str,
+    records: Iterable[Tuple[str, QARecord]],
+    batch_size: int,
+    dense_model: TextEmbedding | None = None,
+    sparse_model: SparseTextEmbedding | None = None,
+) -> Iterable[models.PointStruct]:
+    """Lazily embed records batch by batch and yield the resulting points."""
+    batch: List[Tuple[str, QARecord]] = []
+    for pid, rec in records:
+        batch.append((pid, rec))
+        if len(batch) >= batch_size:
+            yield from build_points(mode, batch, dense_model, sparse_model)
+            batch = []
+
+    # Remainer
+    if batch:
+        yield from build_points(mode, batch, dense_model, sparse_model)
+
+
+def set_indexing_threshold(client: QdrantClient, collection_name: str, threshold: int) -> None:
+    """Update the HNSW indexing threshold (0 disables indexing during bulk uploads)."""
+    client.update_collection(
+        collection_name=collection_name,
+        optimizers_config=models.OptimizersConfigDiff(indexing_threshold=threshold),
+    )
+
+
+def ingest(client: QdrantClient, args: argparse.Namespace) -> int:
+    """Create the collection if needed and upload every record not already indexed."""
+    if args.mode=="sparse":
+       embed_dim = None 
+    embed_dim=args.embed_dim
+    ensure_collection(client, args.collection, args.mode, embed_dim)
 
-    client.upsert(collection_name=collection_name, points=points)
+    # Load and flatten records
+    pairs = load_records(args.file, use_cache=not args.no_cache)
+    if not pairs:
+        logging.warning("No records found in input JSON.")
+        return 0
+
+    # Optionally get existing IDs to skip
+    existing_ids = set()
+    if args.skip_existing:
+        existing_ids = fetch_existing_ids(client, args.collection, (rec.thread_ts for _, rec in pairs))
+
+    # Process in batches
+    to_process: List[Tuple[str, QARecord]] = [
+        (pid, rec) for (pid, rec) in pairs if (not args.skip_existing or pid not in existing_ids)
+    ]
+    skipped = len(pairs) - len(to_process)
+    if skipped:
+        logging.info("Skipping %d existing records.", skipped)
+    to_process = sort_by_length(to_process)
+
+    if not to_process:
+        logging.info("Nothing new to index in collection '%s'.", args.collection)
+        return 0
+
+    # Prepare embedders (loaded once, reused for every batch)
+    dense_model = None
+    sparse_model = None
+    if args.mode.lower() in {"dense", "hybrid"}:
+        logging.info("Loading embedding model: %s", args.model)
+        dense_model = TextEmbedding(
+            model_name=args.model,
+            providers=ONNX_PROVIDERS[args.device],
+            threads=os.cpu_count(),
+        )
+    if args.mode.lower() in {"sparse", "hybrid"}:
+        logging.info("Loading sparse model: %s", SPARSE_MODEL)
+        sparse_model = SparseTextEmbedding(model_name=SPARSE_MODEL)
+
+    embed_batch_size = args.embed_batch_size or (
+        GPU_EMBED_BATCH_SIZE if args.device == "cuda" else args.batch_size
+    )
+    logging.info(
+        "Indexing %d records (batch size=%d, embed batch size=%d, parallel=%d)...",
+        len(to_process), args.batch_size, embed_batch_size, args.parallel,
+    )
+
+    # Embedding happens lazily in this process while the upload workers send batches;
+    # HNSW indexing is paused for the duration of the bulk upload.
+    set_indexing_threshold(client, args.collection, 0)
+    try:
+        client.upload_points(
+            collection_name=args.collection,
+            points=iter_points(args.mode, to_process, embed_batch_size, dense_model, sparse_model),
+            batch_size=args.batch_size,
+            parallel=max(1, args.parallel),
+        )
+    finally:
+        set_indexing_threshold(client, args.collection, DEFAULT_INDEXING_THRESHOLD)
+    total = len(to_process)
+
+    logging.info("Done. Upserted %d points into collection '%s'.", total, args.collection)
+    return 0
 
 
 def main(argv: List[str] | None = None) -> int:
@@ -215,6 +420,12 @@ def main(argv: List[str] | None = None) -> int:
         default="http://localhost:6333",
         help="Qdrant URL (e.g., http://localhost:6333)",
     )
+    parser.add_argument(
+        "--grpc-port",
+        type=int,
+        default=DEFAULT_GRPC_PORT,
+        help=f"Qdrant gRPC port (default: {DEFAULT_GRPC_PORT})",
+    )
     parser.add_argument(
         "--model",
         default=DEFAULT_MODEL,
@@ -229,14 +440,37 @@ def main(argv: List[str] | None = None) -> int:
     parser.add_argument(
         "--batch-size",
         type=int,
-        default=256,
-        help="Batch size for embeddings/upserts",
+        default=DEFAULT_BATCH_SIZE,
+        help=f"Batch size for embeddings/upserts (default: {DEFAULT_BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=DEFAULT_PARALLEL,
+        help=f"Number of upload worker processes (default: {DEFAULT_PARALLEL})",
+    )
+    parser.add_argument(
+        "--embed-batch-size",
+        type=int,
+        default=None,
+        help=f"Texts per embedding call (default: --batch-size on cpu, {GPU_EMBED_BATCH_SIZE} on cuda)",
+    )
+    parser.add_argument(
+        "--device",
+        choices=sorted(ONNX_PROVIDERS),
+        default="cpu",
+        help="ONNX execution provider for the dense model; cuda requires fastembed-gpu",
     )
     parser.add_argument(
         "--skip-existing",
         action="store_true",
         help="Skip records whose IDs already exist in the collection to avoid re-embedding",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always re-parse the input file instead of using the <file>.records.pkl cache",
+    )
     parser.add_argument(
         "--mode",
         default="dense",
@@ -251,66 +485,17 @@ def main(argv: List[str] | None = None) -> int:
     )
 
     # Initialize clients
-    client = QdrantClient(args.qdrant_url)
-    if args.mode=="sparse":
-       embed_dim = None 
-    embed_dim=args.embed_dim
-    ensure_collection(client, args.collection, args.mode, embed_dim)
-
-    # Load and flatten records
-    data = load_data(args.file)
-    pairs = list(iter_records(data))
-    if not pairs:
-        logging.warning("No records found in input JSON.")
-        return 0
-
-    # Optionally get existing IDs to skip
-    existing_ids = set()
-    if args.skip_existing:
-        existing_ids = fetch_existing_ids(client, args.collection)
-
-    # Prepare embedder
-    # logging.info("Loading embedding model: %s", args.model)
-    # embedder = TextEmbedding(model_name=args.model)
-
-    # Process in batches
-    total = 0
-    to_process: List[Tuple[str, Dict]] = [
-        (pid, rec) for (pid, rec) in pairs if (not args.skip_existing or pid not in existing_ids)
-    ]
-    skipped = len(pairs) - len(to_process)
-    if skipped:
-        logging.info("Skipping %d existing records.", skipped)
-
-    logging.info("Indexing %d records (batch size=%d)...", len(to_process), args.batch_size)
-
-    batch_ids: List[str] = []
-    batch_records: List[Dict] = []
-    for pid, rec in to_process:
-        batch_ids.append(pid)
-        batch_records.append(rec)
-
-        if len(batch_ids) >= args.batch_size:
-            ##texts = [concatenate_text(r) for r in batch_records]
-            ##vectors = embed_texts(embedder, texts)
-
-            batch = list(zip(batch_ids, batch_records))
-            upsert_points(client,args.collection, args.mode,batch,args.model)
-
-            total += len(batch)
-            batch_ids.clear()
-            batch_records.clear()
-
-    # Remainer
-    if batch_ids:
-        #texts = [concatenate_text(r) for r in batch_records]
-        #vectors = embed_texts(embedder, texts)
-        batch = list(zip(batch_ids, batch_records))
-        upsert_points(client,args.collection, args.mode,batch,args.model)
-        total += len(batch)
-
-    logging.info("Done. Upserted %d points into collection '%s'.", total, args.collection)
-    return 0
+    client = QdrantClient(
+        args.qdrant_url,
+        prefer_grpc=True,
+        grpc_port=args.grpc_port,
+        grpc_options=GRPC_OPTIONS,
+        timeout=CLIENT_TIMEOUT,
+    )
+    try:
+        return ingest(client, args)
+    finally:
+        client.close()
 
 
 if __name__ == "__main__":
@@ -1,12 +1,15 @@
+import asyncio
 import os
+import threading
 import time
+from contextlib import contextmanager
 from datetime import datetime
 
+import psycopg2
 import streamlit as st
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Float, Numeric
-from sqlalchemy.orm import declarative_base, sessionmaker
+from psycopg2.pool import ThreadedConnectionPool
 
-from rag_core import rag, calculate_llm_cost, compute_relevancy  # must return dict
+from rag_core import rag_stream, calculate_llm_cost, compute_relevancy
 
 st.set_page_config(page_title="RAG Q&A", page_icon="🧠", layout="centered")
 
@@ -18,45 +21,116 @@ PG_PORT = int(os.getenv("POSTGRES_PORT", "5432"))
 PG_DB = os.getenv("POSTGRES_DB", "rag_metrics")
 PG_USER = os.getenv("POSTGRES_USER", "postgres")
 PG_PASSWORD = os.getenv("POSTGRES_PASSWORD", "postgres")
+PG_POOL_MAX = 16
 
-DB_URL = f"postgresql+psycopg2://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}"
-
-# SQLAlchemy setup
-Base = declarative_base()
-
-def get_engine():
-    return create_engine(DB_URL, pool_pre_ping=True)
-
-_engine = None
-_SessionLocal = None
-
-def get_session():
-    global _engine, _SessionLocal
-    if _engine is None:
-        _engine = get_engine()
-    if _SessionLocal is None:
-        _SessionLocal = sessionmaker(bind=_engine)
-    return _SessionLocal()
-
-# ORM model
-class Interaction(Base):
-    __tablename__ = "interactions"
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
-    question = Column(Text, nullable=False)
-    answer = Column(Text, nullable=False)
-    feedback = Column(String(10), nullable=True)  # 'up' | 'down' | None
-    latency_ms = Column(Float, nullable=True)
-    tokens_in = Column(Integer, nullable=True)
-    tokens_out = Column(Integer, nullable=True)
-    cost = Column(Numeric(10, 6), nullable=True)       # USD cost
-    relevancy = Column(String, nullable=True)          # e.g. "RELEVANT"
-    relevancy_explanation = Column(Text, nullable=True) # explanation
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS interactions (
+    id SERIAL PRIMARY KEY,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    feedback VARCHAR(10),               -- 'up' | 'down' | NULL
+    latency_ms DOUBLE PRECISION,
+    tokens_in INTEGER,
+    tokens_out INTEGER,
+    cost NUMERIC(10, 6),                -- USD cost
+    relevancy VARCHAR,                  -- e.g. 'RELEVANT'
+    relevancy_explanation TEXT
+)
+"""
+
+INSERT_SQL = """
+INSERT INTO interactions (
+    created_at, question, answer, latency_ms, tokens_in, tokens_out,
+    cost, relevancy, relevancy_explanation
+) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+RETURNING id
+"""
+
+# Connection pool cached across reruns
+@st.cache_resource
+def get_pool():
+    return ThreadedConnectionPool(
+        1, PG_POOL_MAX,
+        host=PG_HOST, port=PG_PORT, dbname=PG_DB, user=PG_USER, password=PG_PASSWORD,
+    )
+
+def _checkout(pool):
+    """Borrow a connection that answers a ping, discarding stale ones (e.g. after a Postgres restart)."""
+    # Every idle connection can be stale after a restart, so allow one try per pool slot
+    for _ in range(PG_POOL_MAX + 1):
+        conn = pool.getconn()
+        try:
+            if not conn.closed:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+                return conn
+        except psycopg2.Error:
+            pass
+        pool.putconn(conn, close=True)
+    raise psycopg2.OperationalError("No working Postgres connection in the pool")
+
+@contextmanager
+def get_conn():
+    """Borrow a validated pooled connection; commit on success, roll back on error."""
+    pool = get_pool()
+    conn = _checkout(pool)
+    try:
+        with conn:
+            yield conn
+    finally:
+        # Drop connections the server closed (e.g. after a Postgres restart)
+        pool.putconn(conn, close=bool(conn.closed))
+
+def insert_interaction(question, answer, latency_ms, tokens_in, tokens_out, cost, relevancy, relevancy_explanation):
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(INSERT_SQL, (
+            datetime.utcnow(), question, answer, latency_ms, tokens_in, tokens_out,
+            cost, relevancy, relevancy_explanation,
+        ))
+        return cur.fetchone()[0]
+
+def fetch_interaction(row_id):
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT tokens_in, tokens_out, cost, relevancy, relevancy_explanation, latency_ms "
+            "FROM interactions WHERE id = %s",
+            (row_id,),
+        )
+        return cur.fetchone()
+
+def save_feedback(row_id, feedback):
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("UPDATE interactions SET feedback = %s WHERE id = %s", (feedback, row_id))
+
+# Single long-lived event loop so the async OpenAI client keeps its connections
+@st.cache_resource
+def get_event_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+def run_async(coro):
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+def iter_async(agen):
+    """Drive an async generator on the app's event loop from synchronous code."""
+    loop = get_event_loop()
+    while True:
+        try:
+            yield asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result()
+        except StopAsyncIteration:
+            return
 
 # Create table if it doesn't exist (do this once at app start)
+@st.cache_resource
+def init_db():
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(CREATE_TABLE_SQL)
+
 try:
-    eng = get_engine()
-    Base.metadata.create_all(eng)
+    init_db()
 except Exception as e:
     st.sidebar.warning(f"DB not ready yet: {e}")
 
@@ -82,31 +156,36 @@ ask_clicked = st.button("Ask")
 if ask_clicked:
     if query.strip():
         t0 = time.perf_counter()
-        with st.spinner("Thinking with RAG…"):
-            try:
-                rag_result = rag(query)  # dict: answer, tokens_in, tokens_out
-                answer_text = rag_result.get("answer", "")
-                tokens_in = int(rag_result.get("tokens_in", 0) or 0)
-                tokens_out = int(rag_result.get("tokens_out", 0) or 0)
-                cost = calculate_llm_cost(tokens_in, tokens_out)
-
-                # Compute relevancy (expected dict with "Relevance" & "Explanation")
-                rel = compute_relevancy(query, answer_text)
-                relevancy = None
-                relevancy_expl = None
-                if isinstance(rel, dict):
-                    relevancy = str(rel.get("Relevance"))
-                    relevancy_expl = str(rel.get("Explanation"))
-            except Exception as e:
-                answer_text = f"❌ Error calling rag(): {e}"
-                tokens_in, tokens_out, cost = 0, 0, None
-                relevancy, relevancy_expl = None, None
+        # Stream the answer as it is generated; replaced by the persisted view below
+        live_answer = st.empty()
+        try:
+            rag_result = {}  # filled by rag_stream: answer, tokens_in, tokens_out
+            with live_answer.container():
+                st.write("### Answer")
+                streamed = st.write_stream(iter_async(rag_stream(query, result=rag_result)))
+            answer_text = rag_result.get("answer", streamed)
+            tokens_in = int(rag_result.get("tokens_in", 0) or 0)
+            tokens_out = int(rag_result.get("tokens_out", 0) or 0)
+            cost = calculate_llm_cost(tokens_in, tokens_out)
+
+            # Compute relevancy (expected dict with "Relevance" & "Explanation")
+            with st.spinner("Evaluating relevancy…"):
+                rel = run_async(compute_relevancy(query, answer_text))
+            relevancy = None
+            relevancy_expl = None
+            if isinstance(rel, dict):
+                relevancy = str(rel.get("Relevance"))
+                relevancy_expl = str(rel.get("Explanation"))
+        except Exception as e:
+            answer_text = f"❌ Error calling rag(): {e}"
+            tokens_in, tokens_out, cost = 0, 0, None
+            relevancy, relevancy_expl = None, None
         latency = (time.perf_counter() - t0) * 1000.0
+        live_answer.empty()
 
         # Persist Q&A
         try:
-            session = get_session()
-            row = Interaction(
+            row_id = insert_interaction(
                 question=query,
                 answer=str(answer_text),
                 latency_ms=latency,
@@ -116,19 +195,12 @@ if ask_clicked:
                 relevancy=relevancy,
                 relevancy_explanation=relevancy_expl,
             )
-            session.add(row)
-            session.commit()
-            st.session_state.last_row_id = row.id
+            st.session_state.last_row_id = row_id
             st.session_state.last_answer = str(answer_text)
             st.session_state.last_question = query
             st.session_state.last_feedback = None
         except Exception as db_err:
             st.error(f"Failed to save interaction: {db_err}")
-        finally:
-            try:
-                session.close()
-            except Exception:
-                pass
     else:
         st.warning("Please enter a question before asking.")
 
@@ -139,24 +211,19 @@ if st.session_state.last_answer is not None:
 
     if st.session_state.last_row_id:
         try:
-            session = get_session()
-            obj = session.get(Interaction, st.session_state.last_row_id)
-            if obj:
+            row = fetch_interaction(st.session_state.last_row_id)
+            if row:
+                tokens_in, tokens_out, cost, relevancy, relevancy_expl, latency_ms = row
                 st.caption(
-                    f"Tokens in: {obj.tokens_in or 0} • "
-                    f"Tokens out: {obj.tokens_out or 0} • "
-                    f"Cost: ${format(obj.cost or 0, '.6f')} • "
-                    f"Relevancy: {obj.relevancy or '-'} • "
-                    f"Explanation: {obj.relevancy_explanation or '-'} • "
-                    f"Latency: {obj.latency_ms:.1f} ms"
+                    f"Tokens in: {tokens_in or 0} • "
+                    f"Tokens out: {tokens_out or 0} • "
+                    f"Cost: ${format(cost or 0, '.6f')} • "
+                    f"Relevancy: {relevancy or '-'} • "
+                    f"Explanation: {relevancy_expl or '-'} • "
+                    f"Latency: {latency_ms:.1f} ms"
                 )
         except Exception:
             pass
-        finally:
-            try:
-                session.close()
-            except Exception:
-                pass
 
     col1, col2 = st.columns(2)
 
@@ -167,38 +234,20 @@ if st.session_state.last_answer is not None:
         if st.button("👍 Helpful", key="fb_up", disabled=up_disabled):
             if st.session_state.last_row_id:
                 try:
-                    session = get_session()
-                    obj = session.get(Interaction, st.session_state.last_row_id)
-                    if obj:
-                        obj.feedback = "up"
-                        session.commit()
-                        st.session_state.last_feedback = "up"
-                        st.success("Thanks for your feedback! 👍")
+                    save_feedback(st.session_state.last_row_id, "up")
+                    st.session_state.last_feedback = "up"
+                    st.success("Thanks for your feedback! 👍")
                 except Exception as e:
                     st.error(f"Failed to save feedback: {e}")
-                finally:
-                    try:
-                        session.close()
-                    except Exception:
-                        pass
     with col2:
         if st.button("👎 Not Helpful", key="fb_down", disabled=down_disabled):
             if st.session_state.last_row_id:
                 try:
-                    session = get_session()
-                    obj = session.get(Interaction, st.session_state.last_row_id)
-                    if obj:
-                        obj.feedback = "down"
-                        session.commit()
-                        st.session_state.last_feedback = "down"
-                        st.info("Thanks for letting us know. 👎")
+                    save_feedback(st.session_state.last_row_id, "down")
+                    st.session_state.last_feedback = "down"
+                    st.info("Thanks for letting us know. 👎")
                 except Exception as e:
                     st.error(f"Failed to save feedback: {e}")
-                finally:
-                    try:
-                        session.close()
-                    except Exception:
-                        pass
 
 # Helpful footer
 st.caption(
@@ -1,22 +1,35 @@
 from search_qa import run_search, make_client, search_dense
-import json
-from tqdm.auto import tqdm
+import asyncio
+import hashlib
+from collections import OrderedDict
+
+import orjson
 
 
 from dotenv import load_dotenv
 from dotenv import dotenv_values
 
-from openai import OpenAI
+from openai import AsyncOpenAI
 
 
 db_client = make_client()
 
 config = dotenv_values(".env")
 api_key = config.get("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key)
+client = AsyncOpenAI(api_key=api_key)
 
-def build_prompt(query, search_results):
-    prompt_template = """
+# LRU of completed LLM calls keyed by (model, sha256(prompt))
+LLM_CACHE_SIZE = 2048
+_llm_cache = OrderedDict()
+
+# Payload fields build_prompt reads from each search hit
+CONTEXT_FIELDS = ["question", "answer"]
+
+# The app is long-lived and can't see re-ingests, so it always queries Qdrant
+# rather than using search_qa's result memoization (meant for batch/eval runs)
+USE_SEARCH_CACHE = False
+
+PROMPT_TEMPLATE = """
 You're a course teaching assistant. Answer the QUESTION based on the CONTEXT from the FAQ database.
 Use only the facts from the CONTEXT when answering the QUESTION.
 
@@ -26,20 +39,96 @@ Use only the facts from the CONTEXT when answering the QUESTION.
     {context}
     """.strip()
 
-    context = ""
-    
-    for doc in search_results:
-        context = context + f"question: {doc.payload['question']}\n answer: {doc.payload['answer']}\n\n"
-    
-    prompt = prompt_template.format(question=query, context=context).strip()
+def build_prompt(query, search_results):
+    context = "".join(
+        f"question: {doc.payload['question']}\n answer: {doc.payload['answer']}\n\n"
+        for doc in search_results
+    )
+    prompt = PROMPT_TEMPLATE.format(question=query, context=context).strip()
     return prompt
 
 
 
-def llm(prompt, model='gpt-4o-mini'):
-    response = client.chat.completions.create(
+async def llm(prompt, model='gpt-4o-mini', json_mode=False):
+    """
+    Return the completion for prompt, reusing a cached answer for repeated prompts.
+
+    json_mode asks the API for a JSON object response. Cache hits report zero
+    tokens so cost accounting only counts real API calls.
+    """
+    key = _llm_cache_key(prompt, model, json_mode)
+    cached = _llm_cache_get(key)
+    if cached is not None:
+        return {"answer": cached, "tokens_in": 0, "tokens_out": 0}
+
+    result = await _llm_uncached(prompt, model=model, json_mode=json_mode)
+    _llm_cache_put(key, result["answer"])
+    return result
+
+
+async def llm_stream(prompt, model='gpt-4o-mini', result=None):
+    """
+    Yield the completion for prompt as text deltas as they arrive.
+
+    Once the stream ends, `result` (if given) is filled with the same
+    answer/tokens_in/tokens_out keys that llm() returns.
+    """
+    if result is None:
+        result = {}
+    key = _llm_cache_key(prompt, model)
+    cached = _llm_cache_get(key)
+    if cached is not None:
+        result.update(answer=cached, tokens_in=0, tokens_out=0)
+        yield cached
+        return
+
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    parts = []
+    tokens_in, tokens_out = 0, 0
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            yield chunk.choices[0].delta.content
+        # usage only arrives on the final chunk
+        if chunk.usage:
+            tokens_in = chunk.usage.prompt_tokens
+            tokens_out = chunk.usage.completion_tokens
+
+    answer = "".join(parts)
+    _llm_cache_put(key, answer)
+    result.update(answer=answer, tokens_in=tokens_in, tokens_out=tokens_out)
+
+
+def _llm_cache_key(prompt, model, json_mode=False):
+    return (model, json_mode, hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+
+
+def _llm_cache_get(key):
+    cached = _llm_cache.get(key)
+    if cached is not None:
+        _llm_cache.move_to_end(key)
+    return cached
+
+
+def _llm_cache_put(key, answer):
+    if answer is None:
+        return
+    _llm_cache[key] = answer
+    if len(_llm_cache) > LLM_CACHE_SIZE:
+        _llm_cache.popitem(last=False)
+
+
+async def _llm_uncached(prompt, model='gpt-4o-mini', json_mode=False):
+    extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+    response = await client.chat.completions.create(
         model=model,
-        messages=[{"role": "user", "content": prompt}]
+        messages=[{"role": "user", "content": prompt}],
+        **extra,
     )
     
     answer = response.choices[0].message.content
@@ -55,10 +144,11 @@ def llm(prompt, model='gpt-4o-mini'):
     }
 
 
-def rag(query,method='dense', model='gpt-4o-mini',limit=5) -> str:
-    search_results = run_search(method, query, client=db_client,limit=limit)
+async def rag(query,method='dense', model='gpt-4o-mini',limit=5) -> str:
+    # Qdrant client is synchronous; keep it off the event loop
+    search_results = await asyncio.to_thread(run_search, method, query, client=db_client, limit=limit, payload_fields=CONTEXT_FIELDS, use_cache=USE_SEARCH_CACHE)
     prompt = build_prompt(query, search_results)
-    answer = llm(prompt, model=model)
+    answer = await llm(prompt, model=model)
     return {
         "answer": answer["answer"],
         "tokens_in": answer["tokens_in"],
@@ -66,6 +156,14 @@ def rag(query,method='dense', model='gpt-4o-mini',limit=5) -> str:
     }
 
 
+async def rag_stream(query, method='dense', model='gpt-4o-mini', limit=5, result=None):
+    """Streaming rag(): yields answer deltas and fills `result` like rag() returns."""
+    search_results = await asyncio.to_thread(run_search, method, query, client=db_client, limit=limit, payload_fields=CONTEXT_FIELDS, use_cache=USE_SEARCH_CACHE)
+    prompt = build_prompt(query, search_results)
+    async for delta in llm_stream(prompt, model=model, result=result):
+        yield delta
+
+
 def calculate_llm_cost(tokens_in: int, tokens_out: int) -> float:
     """
     Calculate the USD cost of a gpt-4o-mini call.
@@ -86,8 +184,7 @@ def calculate_llm_cost(tokens_in: int, tokens_out: int) -> float:
 
 
 
-def compute_relevancy(question, answer):
-    prompt_template = """
+RELEVANCY_PROMPT_TEMPLATE = """
     You are an expert evaluator for a Retrieval-Augmented Generation (RAG) system.
     Your task is to analyze the relevance of the generated answer to the given question.
     Based on the relevance of the generated answer, you will classify it
@@ -107,17 +204,19 @@ def compute_relevancy(question, answer):
     }}
     """.strip()
 
-    prompt = prompt_template.format(question=question, answer=answer)
-    result=llm(prompt)
+
+async def compute_relevancy(question, answer):
+    prompt = RELEVANCY_PROMPT_TEMPLATE.format(question=question, answer=answer)
+    result=await llm(prompt, json_mode=True)
     
     try:
-        json_eval = json.loads(result["answer"])
+        json_eval = orjson.loads(result["answer"])
     
         return {
         "Relevance":  json_eval['Relevance'],
         "Explanation": json_eval['Explanation'],
          }
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         return {
         "Relevance":  "UNKNOWN",
         "Explanation": "Failed to parse evaluation",
@@ -137,5 +236,5 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    print(rag(args.query,method=args.method,limit=args.limit))
+    print(asyncio.run(rag(args.query,method=args.method,limit=args.limit)))
  
\ No newline at end of file
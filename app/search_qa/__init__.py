@@ -1,6 +1,10 @@
 from .search import (
     run_search,
+    run_search_batch,
+    run_search_many,
     make_client,
+    close_clients,
+    clear_search_cache,
     search_sparse,
     search_dense,
     search_hyprid,
@@ -8,7 +12,11 @@ from .search import (
 
 __all__ = [
     "run_search",
+    "run_search_batch",
+    "run_search_many",
     "make_client",
+    "close_clients",
+    "clear_search_cache",
     "search_sparse",
     "search_dense",
     "search_hyprid",
@@ -1,5 +1,10 @@
 from qdrant_client import QdrantClient, models
+from fastembed import SparseTextEmbedding, TextEmbedding
+import functools
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 
 
@@ -7,130 +12,337 @@ import os
 #DEFAULT_HOST = "http://localhost"
 #DEFAULT_PORT = 6333
 DEFAULT_MODEL = "jinaai/jina-embeddings-v2-base-en"
+DEFAULT_CHANNEL = "#course-llm-zoomcamp"
 
 
 DEFAULT_HOST = os.getenv("QDRANT_HOST", "http://localhost")
 DEFAULT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
+DEFAULT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
 
+SPARSE_MODEL = "Qdrant/bm25"
+# Floor on candidates per hybrid prefetch stage; see hybrid_prefetch_limit
+HYBRID_MIN_PREFETCH = 50
 
-def make_client(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
-    """Create a Qdrant client."""
-    return QdrantClient(f"{host}:{port}")
-
-
-def search_sparse(client, query: str, channel: str = "#course-llm-zoomcamp", limit: int = 1):
-    results = client.query_points(
-        collection_name="salck_sparse",
-        query=models.Document(
-            text=query,
-            model="Qdrant/bm25",
-        ),
-        query_filter=models.Filter(
-            must=[
-                models.FieldCondition(
-                    key="channel",
-                    match=models.MatchValue(value=channel),
-                )
-            ]
-        ),
+# Query embeddings kept per (query, model); repeated questions skip inference entirely
+QUERY_EMBED_CACHE_SIZE = 4096
+
+# LRU of search results keyed by client + every search argument; see clear_search_cache
+SEARCH_CACHE_SIZE = 4096
+_search_cache = OrderedDict()
+_search_cache_lock = threading.Lock()
+
+
+# Shared clients keyed by (host, port, grpc_port) so connections are reused across calls
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def make_client(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, grpc_port: int = DEFAULT_GRPC_PORT):
+    """Return the shared gRPC Qdrant client for this endpoint, creating it on first use."""
+    key = (host, port, grpc_port)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = QdrantClient(f"{host}:{port}", grpc_port=grpc_port, prefer_grpc=True)
+    return client
+
+
+def close_clients():
+    """Close and forget every shared client (e.g. at CLI teardown)."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    # Cached results are keyed by client identity, which a new client could reuse
+    clear_search_cache()
+    for client in clients:
+        client.close()
+
+
+def clear_search_cache():
+    """Forget memoized search results, e.g. after re-ingesting a collection."""
+    with _search_cache_lock:
+        _search_cache.clear()
+
+
+def _is_shared_client(client) -> bool:
+    """Only make_client clients are cached: they live until close_clients, so their id() can't be reused."""
+    with _clients_lock:
+        return any(shared is client for shared in _clients.values())
+
+
+def _search_cache_key(client, method, query, model_handle, channel, limit, options):
+    frozen = tuple(sorted((name, tuple(value) if isinstance(value, list) else value) for name, value in options.items()))
+    return (id(client), method, query, model_handle, channel, limit, frozen)
+
+
+def _search_cache_get(key):
+    with _search_cache_lock:
+        points = _search_cache.get(key)
+        if points is not None:
+            _search_cache.move_to_end(key)
+    # Hand out copies so callers can't alter the cached list
+    return None if points is None else list(points)
+
+
+def _search_cache_put(key, points):
+    with _search_cache_lock:
+        _search_cache[key] = list(points)
+        if len(_search_cache) > SEARCH_CACHE_SIZE:
+            _search_cache.popitem(last=False)
+
+
+# Query embedding models keyed by (class, model name); the lock keeps concurrent searches
+# (e.g. run_search_many workers) from each loading their own copy on a cold start
+_embed_models = {}
+_embed_models_lock = threading.Lock()
+
+
+def _embed_model(model_name: str, factory):
+    key = (factory, model_name)
+    with _embed_models_lock:
+        model = _embed_models.get(key)
+        if model is None:
+            model = _embed_models[key] = factory(model_name)
+    return model
+
+
+def _dense_model(model_handle: str) -> TextEmbedding:
+    return _embed_model(model_handle, TextEmbedding)
+
+
+def _sparse_model() -> SparseTextEmbedding:
+    return _embed_model(SPARSE_MODEL, SparseTextEmbedding)
+
+
+@functools.lru_cache(maxsize=QUERY_EMBED_CACHE_SIZE)
+def embed_dense(query: str, model_handle: str) -> tuple:
+    """Embed a query locally with fastembed; cached as a tuple so callers can't mutate it."""
+    return tuple(next(iter(_dense_model(model_handle).query_embed(query))).tolist())
+
+
+@functools.lru_cache(maxsize=QUERY_EMBED_CACHE_SIZE)
+def embed_sparse(query: str) -> models.SparseVector:
+    """BM25 query vector; IDF weighting is applied server-side by the collection's modifier."""
+    embedding = next(iter(_sparse_model().query_embed(query)))
+    return models.SparseVector(indices=embedding.indices.tolist(), values=embedding.values.tolist())
+
+
+@functools.lru_cache(maxsize=128)
+def _channel_filter(channel: str) -> models.Filter:
+    """One shared Filter per channel; requests only read it, so reuse is safe."""
+    return models.Filter(
+        must=[
+            models.FieldCondition(
+                key="channel",
+                match=models.MatchValue(value=channel),
+            )
+        ]
+    )
+
+
+def _payload_selector(payload_fields: list[str] | None):
+    """None returns the full payload, a list only those fields, [] no payload at all."""
+    if payload_fields is None:
+        return True
+    if not payload_fields:
+        return False
+    return models.PayloadSelectorInclude(include=list(payload_fields))
+
+
+def sparse_request(query: str, channel: str = DEFAULT_CHANNEL, limit: int = 1, payload_fields: list[str] | None = None) -> models.QueryRequest:
+    return models.QueryRequest(
+        query=embed_sparse(query),
+        filter=_channel_filter(channel),
         using="sparse",
         limit=limit,
-        with_payload=True,
+        with_payload=_payload_selector(payload_fields),
     )
-    return results.points
-
-
-def search_dense(client, query: str, model_handle: str, channel: str = "#course-llm-zoomcamp", limit: int = 1):
-    results = client.query_points(
-        collection_name="salck_dense",
-        query=models.Document(
-            text=query,
-            model=model_handle,
-        ),
-        query_filter=models.Filter(
-            must=[
-                models.FieldCondition(
-                    key="channel",
-                    match=models.MatchValue(value=channel),
-                )
-            ]
-        ),
+
+
+def dense_request(query: str, model_handle: str, channel: str = DEFAULT_CHANNEL, limit: int = 1, payload_fields: list[str] | None = None) -> models.QueryRequest:
+    return models.QueryRequest(
+        query=list(embed_dense(query, model_handle)),
+        filter=_channel_filter(channel),
         using="dense",
         limit=limit,
-        with_payload=True,
+        with_payload=_payload_selector(payload_fields),
     )
-    return results.points
 
 
-def search_hyprid(client, query: str, model_handle: str, channel: str = "#course-llm-zoomcamp", limit: int = 1):
-    results = client.query_points(
-        collection_name="salck_hyprid",
+def hybrid_prefetch_limit(limit: int) -> int:
+    """Candidates each hybrid stage hands to RRF: enough for recall at small limits, ~4x at large ones."""
+    return max(HYBRID_MIN_PREFETCH, 4 * limit)
+
+
+def hyprid_request(
+    query: str,
+    model_handle: str,
+    channel: str = DEFAULT_CHANNEL,
+    limit: int = 1,
+    payload_fields: list[str] | None = None,
+    dense_prefetch: int | None = None,
+    sparse_prefetch: int | None = None,
+) -> models.QueryRequest:
+    return models.QueryRequest(
         prefetch=[
             models.Prefetch(
-                query=models.Document(
-                    text=query,
-                    model=model_handle,
-                ),
+                query=list(embed_dense(query, model_handle)),
                 using="dense",
-                limit=(5 * limit),
+                limit=dense_prefetch or hybrid_prefetch_limit(limit),
             ),
             models.Prefetch(
-                query=models.Document(
-                    text=query,
-                    model="Qdrant/bm25",
-                ),
+                query=embed_sparse(query),
                 using="sparse",
-                limit=(5 * limit),
+                limit=sparse_prefetch or hybrid_prefetch_limit(limit),
             ),
         ],
-        query_filter=models.Filter(
-            must=[
-                models.FieldCondition(
-                    key="channel",
-                    match=models.MatchValue(value=channel),
-                )
-            ]
-        ),
+        filter=_channel_filter(channel),
         query=models.FusionQuery(fusion=models.Fusion.RRF),
-        with_payload=True,
+        limit=limit,
+        with_payload=_payload_selector(payload_fields),
     )
-    return results.points
 
 
-# Function registry (needs client + model when called)
-search_functions = {
-    "sparse": lambda client, query, model_handle, channel, limit: search_sparse(client, query, channel, limit),
-    "dense": lambda client, query, model_handle, channel, limit: search_dense(client, query, model_handle, channel, limit),
-    "hyprid": lambda client, query, model_handle, channel, limit: search_hyprid(client, query, model_handle, channel, limit),
+# Search registry: method -> (collection, builder(query, model_handle, **options)).
+# options are the builder's keyword arguments: channel, limit, payload_fields and,
+# for hyprid only, dense_prefetch / sparse_prefetch.
+search_methods = {
+    "sparse": ("salck_sparse", lambda query, model_handle, **options: sparse_request(query, **options)),
+    "dense": ("salck_dense", dense_request),
+    "hyprid": ("salck_hyprid", hyprid_request),
 }
 
 
-def run_search(method: str, query: str, client=None, model_handle: str = DEFAULT_MODEL, channel: str = "#course-llm-zoomcamp", limit: int = 1):
-    """Dynamically run a search by method name."""
-    if method not in search_functions:
-        raise ValueError(f"Unknown search method: {method}. Choose from {list(search_functions.keys())}.")
+def _check_method(method: str):
+    if method not in search_methods:
+        raise ValueError(f"Unknown search method: {method}. Choose from {list(search_methods.keys())}.")
+
+
+def _search_one(client, method: str, query: str, model_handle: str | None, **options):
+    collection_name, build_request = search_methods[method]
+    request = build_request(query, model_handle, **options)
+    return client.query_batch_points(collection_name=collection_name, requests=[request])[0].points
+
+
+def search_sparse(client, query: str, channel: str = DEFAULT_CHANNEL, limit: int = 1, **options):
+    return _search_one(client, "sparse", query, None, channel=channel, limit=limit, **options)
+
+
+def search_dense(client, query: str, model_handle: str, channel: str = DEFAULT_CHANNEL, limit: int = 1, **options):
+    return _search_one(client, "dense", query, model_handle, channel=channel, limit=limit, **options)
+
+
+def search_hyprid(client, query: str, model_handle: str, channel: str = DEFAULT_CHANNEL, limit: int = 1, **options):
+    return _search_one(client, "hyprid", query, model_handle, channel=channel, limit=limit, **options)
+
+
+def run_search(method: str, query, client=None, model_handle: str = DEFAULT_MODEL, channel: str = DEFAULT_CHANNEL, limit: int = 1, use_cache: bool = True, **options):
+    """Dynamically run a search by method name.
+
+    Extra keyword options go to the method's request builder (see search_methods).
+    A list of queries returns one list of points per query, like run_search_batch.
+    Results are memoized per client and arguments unless use_cache is False; only clients
+    from make_client are cached, since a caller-owned client's id() may be reused once it is collected.
+    """
+    queries = query if isinstance(query, list) else [query]
+    results = run_search_batch(method, queries, client=client, model_handle=model_handle, channel=channel, limit=limit, use_cache=use_cache, **options)
+    return results if isinstance(query, list) else results[0]
+
+
+def run_search_batch(
+    method: str,
+    queries: list,
+    client=None,
+    model_handle: str = DEFAULT_MODEL,
+    channel: str = DEFAULT_CHANNEL,
+    limit: int = 1,
+    batch_size: int = 64,
+    use_cache: bool = True,
+    **options,
+):
+    """Run many queries of one method via query_batch_points, batch_size requests per call.
+
+    Repeated queries within a chunk are sent once, and cached results are reused unless use_cache is False.
+    Returns one list of points per query, in the order of `queries`.
+    """
+    _check_method(method)
     if client is None:
         client = make_client()
-    return search_functions[method](client, query, model_handle, channel, limit)
+    collection_name, build_request = search_methods[method]
+    use_cache = use_cache and _is_shared_client(client)
+    results = []
+    for start in range(0, len(queries), batch_size):
+        chunk = queries[start:start + batch_size]
+        keys = [_search_cache_key(client, method, q, model_handle, channel, limit, options) for q in chunk]
+        found = {}
+        if use_cache:
+            for key in keys:
+                cached = _search_cache_get(key)
+                if cached is not None:
+                    found[key] = cached
+        pending = {key: q for key, q in zip(keys, chunk) if key not in found}
+        if pending:
+            requests = [build_request(q, model_handle, channel=channel, limit=limit, **options) for q in pending.values()]
+            responses = client.query_batch_points(collection_name=collection_name, requests=requests)
+            for key, response in zip(pending, responses):
+                found[key] = response.points
+                if use_cache:
+                    _search_cache_put(key, response.points)
+        results.extend(list(found[key]) for key in keys)
+    return results
 
 
+def run_search_many(method: str, queries: list, client=None, batch_size: int = 16, max_workers: int = 8, **search_args):
+    """Run many queries with up to max_workers query_batch_points calls in flight at once.
+
+    Queries are split into batch_size chunks that worker threads send through run_search_batch
+    (search_args are passed on to it) over the shared client.
+    Set max_workers to roughly the Qdrant server's vCPU count; beyond that requests just queue.
+    Returns one list of points per query, in the order of `queries`.
+    """
+    _check_method(method)
+    if client is None:
+        client = make_client()
+    chunks = [queries[start:start + batch_size] for start in range(0, len(queries), batch_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        parts = pool.map(
+            lambda chunk: run_search_batch(method, chunk, client=client, batch_size=batch_size, **search_args),
+            chunks,
+        )
+        return [points for part in parts for points in part]
+
 
 if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser(description="Run Qdrant search")
-    parser.add_argument("method", choices=search_functions.keys(), help="Search method")
-    parser.add_argument("query", help="Search query")
-    parser.add_argument("--channel", default="#course-llm-zoomcamp", help="Slack channel")
+    parser.add_argument("method", choices=search_methods.keys(), help="Search method")
+    parser.add_argument("query", nargs="+", help="Search query (several queries are sent as one batch)")
+    parser.add_argument("--channel", default=DEFAULT_CHANNEL, help="Slack channel")
     parser.add_argument("--limit", type=int, default=1, help="Number of results")
     parser.add_argument("--host", default=DEFAULT_HOST, help="Qdrant host (default: localhost)")
     parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Qdrant port (default: 6333)")
+    parser.add_argument("--grpc-port", type=int, default=DEFAULT_GRPC_PORT, help="Qdrant gRPC port (default: 6334)")
+    parser.add_argument("--dense-prefetch", type=int, default=None, help="Hybrid: dense candidates fed to fusion (default: max(50, 4*limit))")
+    parser.add_argument("--sparse-prefetch", type=int, default=None, help="Hybrid: sparse candidates fed to fusion (default: max(50, 4*limit))")
+    parser.add_argument("--no-cache", action="store_true", help="Send every query to Qdrant, ignoring memoized results")
     parser.add_argument("--model", default=DEFAULT_MODEL, help="Embedding model (default: jinaai/jina-embeddings-v2-base-en)")
 
     args = parser.parse_args()
 
-    client = make_client(host=args.host, port=args.port)
+    options = {"payload_fields": ["answer"]}
+    for name in ("dense_prefetch", "sparse_prefetch"):
+        if getattr(args, name) is not None:
+            if args.method != "hyprid":
+                parser.error(f"--{name.replace('_', '-')} only applies to hyprid search")
+            options[name] = getattr(args, name)
+
+    client = make_client(host=args.host, port=args.port, grpc_port=args.grpc_port)
 
-    results = run_search(args.method, args.query, client=client, model_handle=args.model, channel=args.channel, limit=args.limit)
-    for r in results:
-        print(r.payload['answer'])
+    batch_results = run_search(args.method, args.query, client=client, model_handle=args.model, channel=args.channel, limit=args.limit, use_cache=not args.no_cache, **options)
+    for query, results in zip(args.query, batch_results):
+        if len(args.query) > 1:
+            print(f"## {query}")
+        for r in results:
+            print(r.payload['answer'])
+    close_clients()
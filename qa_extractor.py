@@ -8,13 +8,18 @@ from typing import Dict, Any
 from dotenv import load_dotenv
 from dotenv import dotenv_values
 
-from openai import OpenAI
+from openai import APIConnectionError, InternalServerError, OpenAI, RateLimitError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 
 
 
 config = dotenv_values(".env")
 api_key = config.get("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key)
+# Retries are owned by the tenacity policy on _chat_completion, so the SDK's own are off
+client = OpenAI(api_key=api_key, max_retries=0)
+
+# Errors worth retrying: network drops/timeouts, rate limits and 5xx responses
+TRANSIENT_ERRORS = (APIConnectionError, RateLimitError, InternalServerError, TimeoutError, ConnectionError)
 
 
 
@@ -77,10 +82,30 @@ Do not include usernames or timestamps outside of the 'asked_by' and 'answered_b
 Be conservative: when in doubt about success, output {"qas": []}.
 """
 
+@retry(
+    wait=wait_random_exponential(min=1, max=30),
+    stop=stop_after_attempt(5),
+    retry=retry_if_exception_type(TRANSIENT_ERRORS),
+    reraise=True,
+)
+def _chat_completion(thread_data: str, model: str, temperature: float):
+    return client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": thread_data},
+        ],
+        temperature=temperature,
+    )
+
+
 def extract_qas(thread_data: str, model: str = "gpt-4o-mini", temperature: float = 0.2) -> Dict[str, Any]:
     """
     Run the LLM on a Slack thread payload and return parsed Q&A JSON.
 
+    Transient API errors (connection drops, timeouts, rate limits, 5xx) are
+    retried up to 5 attempts with randomized exponential backoff.
+
     Parameters
     ----------
     thread_data : str
@@ -102,14 +127,7 @@ def extract_qas(thread_data: str, model: str = "gpt-4o-mini", temperature: float
     ValueError
         If the response is not valid JSON.
     """
-    resp = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": thread_data},
-        ],
-        temperature=temperature,
-    )
+    resp = _chat_completion(thread_data, model, temperature)
 
     if not resp.choices or not resp.choices[0].message or not resp.choices[0].message.content:
         raise RuntimeError("LLM returned no content.")
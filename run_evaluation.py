@@ -1,5 +1,6 @@
-from search_qa import run_search, make_client, search_dense
+from search_qa import run_search, run_search_batch, make_client, search_dense
 import json
+import numpy as np
 from tqdm.auto import tqdm
 
 client = make_client()
@@ -15,37 +16,36 @@ def load_data(ground_truth):
 
 
 def hit_rate(relevance_total):
-    cnt = 0
-
-    for line in relevance_total:
-        if True in line:
-            cnt = cnt + 1
-
-    return cnt / len(relevance_total)   
+    R = np.asarray(relevance_total, dtype=bool)
+    return float(R.any(axis=1).mean())
 
 
 def mrr(relevance_total):
-    total_score = 0.0
-
-    for line in relevance_total:
-        for rank in range(len(line)):
-            if line[rank] == True:
-                total_score = total_score + 1 / (rank + 1)
-
-    return total_score / len(relevance_total)
+    # Each expected id appears at most once per result list, so only the first hit counts
+    R = np.asarray(relevance_total, dtype=bool)
+    first = R.argmax(axis=1)
+    return float(np.where(R.any(axis=1), 1.0 / (first + 1), 0.0).mean())
 
 
 
-def evaluate_search(ground_truth, method):
+def evaluate_search(ground_truth, method, batch_size=64, limit=10):
     relevance_total = []
 
-    for id,questions  in tqdm(ground_truth.items()):
+    # Flatten to (expected_id, question) so queries can be sent in batches
+    pairs = []
+    for id,questions  in ground_truth.items():
         questions_list=json.loads(questions)
         for q in questions_list:
-            results=run_search(method, q, client=client,limit =10)
-            relevance = [d.id == id for d in results[0:10]]
+            pairs.append((id, q))
+
+    for start in tqdm(range(0, len(pairs), batch_size)):
+        chunk = pairs[start:start + batch_size]
+        batch_results = run_search_batch(method, [q for _, q in chunk], client=client, limit=limit, batch_size=batch_size, payload_fields=[])
+        for (id, _), results in zip(chunk, batch_results):
+            relevance = [d.id == id for d in results[0:limit]]
+            # Pad short result lists so rows form a rectangular array
+            relevance += [False] * (limit - len(relevance))
             relevance_total.append(relevance)
-            
 
     return {
         'hit_rate': hit_rate(relevance_total),
@@ -6,13 +6,23 @@ from __future__ import annotations
 
 import argparse
 import json
+import os
 import sys
-from dataclasses import dataclass, asdict
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, asdict, field
+from itertools import repeat
+from operator import attrgetter, itemgetter
 from pathlib import Path
 from typing import Dict, Iterable, List, Optional, Tuple
 
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json is used without it
+    orjson = None
 
-@dataclass
+
+@dataclass(slots=True)
 class Message:
     channel: str
     ts: str
@@ -20,17 +30,19 @@ class Message:
     user: Optional[str]
     thread_ts: Optional[str]
     subtype: Optional[str]
-    raw: dict
+    # Slack marked this message as a thread parent (has replies / reply_count)
+    has_replies: bool = False
+    # float(ts) parsed once; used as the sort key everywhere
+    ts_float: float = field(init=False, repr=False, compare=False)
 
-    @property
-    def ts_float(self) -> float:
+    def __post_init__(self) -> None:
         try:
-            return float(self.ts)
+            self.ts_float = float(self.ts)
         except Exception:
-            return 0.0
+            self.ts_float = 0.0
 
 
-@dataclass
+@dataclass(slots=True)
 class Thread:
     channel: str
     thread_ts: str
@@ -38,17 +50,41 @@ class Thread:
     replies: List[Message]
 
 
-def _read_channel_day_file(path: Path, channel: str) -> Iterable[Message]:
+def _json_loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj, indent: bool = False) -> bytes:
+    """UTF-8 JSON bytes, non-ASCII kept as-is (like ensure_ascii=False)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0))
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
+
+
+def _is_threaded(item: dict) -> bool:
+    """True for messages build_threads keeps: replies (thread_ts) and thread parents."""
+    return bool(item.get("thread_ts") or item.get("replies") or item.get("reply_count"))
+
+
+def _read_channel_day_file(path: Path, channel: str, threads_only: bool = False) -> Iterable[Message]:
     try:
-        data = json.loads(path.read_text(encoding="utf-8"))
+        data = _json_loads(path.read_bytes())
     except Exception as e:
         print(f"Warning: failed to read {path}: {e}", file=sys.stderr)
         return []
 
+    # Most channel-days have no thread activity; skip them before building any Message
+    if threads_only and not any(isinstance(item, dict) and _is_threaded(item) for item in data):
+        return []
+
     messages = []
     for item in data:
         if not isinstance(item, dict):
             continue
+        if threads_only and not _is_threaded(item):
+            continue
         if item.get("type") != "message":
             if item.get("subtype") and not item.get("text"):
                 continue
@@ -62,57 +98,71 @@ def _read_channel_day_file(path: Path, channel: str) -> Iterable[Message]:
             user=item.get("user") or item.get("bot_id") or item.get("username"),
             thread_ts=item.get("thread_ts"),
             subtype=item.get("subtype"),
-            raw=item,
+            has_replies=bool(item.get("replies") or item.get("reply_count")),
         )
         messages.append(msg)
     return messages
 
 
-def load_all_messages(export_root: Path) -> List[Message]:
+def load_all_messages(export_root: Path, workers: int = 1, threads_only: bool = False) -> List[Message]:
+    """Read every channel-day file, in channel/file order.
+
+    By default files are read in this process. workers > 1 (or None for the CPU
+    count) parses them in a process pool instead; every Message then has to be
+    pickled back to the parent, so this only pays off with several cores and
+    large day files. With threads_only, messages that can't
+    belong to a thread are dropped while parsing.
+    """
+    paths: List[Path] = []
+    channels: List[str] = []
+    # scandir entries carry the file type from the directory listing, so no stat per entry
+    with os.scandir(export_root) as it:
+        channel_names = sorted(entry.name for entry in it if entry.is_dir())
+    for channel in channel_names:
+        channel_dir = export_root / channel
+        with os.scandir(channel_dir) as it:
+            day_names = sorted(entry.name for entry in it if entry.name.endswith(".json") and entry.is_file())
+        for name in day_names:
+            paths.append(channel_dir / name)
+            channels.append(channel)
+
     msgs: List[Message] = []
-    for channel_dir in sorted(p for p in export_root.iterdir() if p.is_dir()):
-        channel = channel_dir.name
-        json_files = sorted(channel_dir.glob("*.json"))
-        for jf in json_files:
-            msgs.extend(_read_channel_day_file(jf, channel))
+    if workers == 1 or len(paths) <= 1:
+        for jf, channel in zip(paths, channels):
+            msgs.extend(_read_channel_day_file(jf, channel, threads_only))
+        return msgs
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for day_msgs in pool.map(_read_channel_day_file, paths, channels, repeat(threads_only), chunksize=16):
+            msgs.extend(day_msgs)
     return msgs
 
 
 def build_threads(messages: Iterable[Message]) -> List[Thread]:
-    by_channel: Dict[str, List[Message]] = {}
+    # One pass: group messages by (channel, thread key); a parent keys its own thread
+    grouped: Dict[Tuple[str, str], List[Message]] = defaultdict(list)
     for m in messages:
-        by_channel.setdefault(m.channel, []).append(m)
+        key = m.thread_ts or (m.ts if m.has_replies else None)
+        if key:
+            grouped[(m.channel, key)].append(m)
 
     threads: List[Thread] = []
 
-    for channel, msgs in by_channel.items():
-        roots = {}
-        for m in msgs:
-            if m.raw.get("replies") or m.raw.get("reply_count"):
-                roots[m.ts] = m
+    for (channel, tkey), group in grouped.items():
+        group.sort(key=attrgetter("ts_float"))
+        # Slack parents carry thread_ts == ts, so the root is always inside its own group
+        root = next((m for m in group if m.ts == tkey), None)
 
-        grouped: Dict[str, List[Message]] = {}
-        for m in msgs:
-            key = m.thread_ts or (m.ts if m.ts in roots else None)
-            if not key:
-                continue
-            grouped.setdefault(key, []).append(m)
-
-        for tkey, group in grouped.items():
-            group.sort(key=lambda x: x.ts_float)
-            root = None
-            for m in group:
-                if m.ts == tkey:
-                    root = m
-                    break
-            if not root and tkey in roots:
-                root = roots[tkey]
-
-            replies = [m for m in group if root is None or m.ts != root.ts]
-            threads.append(Thread(channel=channel, thread_ts=tkey, root=root, replies=replies))
-
-    threads.sort(key=lambda th: (th.channel, (th.root.ts_float if th.root else (th.replies[0].ts_float if th.replies else 0.0))))
-    return threads
+        replies = [m for m in group if root is None or m.ts != root.ts]
+        threads.append(Thread(channel=channel, thread_ts=tkey, root=root, replies=replies))
+
+    # Build each key once; itemgetter(0) keeps ties stable without comparing Threads
+    keyed = [
+        ((th.channel, th.root.ts_float if th.root else (th.replies[0].ts_float if th.replies else 0.0)), th)
+        for th in threads
+    ]
+    keyed.sort(key=itemgetter(0))
+    return [th for _, th in keyed]
 
 
 def thread_to_minimal_dict(th: Thread) -> dict:
@@ -149,7 +199,7 @@ def thread_to_llm_text(th: Thread) -> str:
 
 def threads_from_json(path: Path) -> List[Thread]:
     """Load threads back from a dumped JSON file into Thread objects."""
-    data = json.loads(path.read_text(encoding="utf-8"))
+    data = _json_loads(path.read_bytes())
     threads: List[Thread] = []
     for t in data:
         root = None
@@ -161,7 +211,7 @@ def threads_from_json(path: Path) -> List[Thread]:
                 user=t["root"].get("user"),
                 thread_ts=t["root"].get("thread_ts"),
                 subtype=t["root"].get("subtype"),
-                raw=t["root"],
+                has_replies=bool(t.get("replies")),
             )
         replies = []
         for r in t.get("replies", []):
@@ -173,7 +223,6 @@ def threads_from_json(path: Path) -> List[Thread]:
                     user=r.get("user"),
                     thread_ts=r.get("thread_ts"),
                     subtype=r.get("subtype"),
-                    raw=r,
                 )
             )
         threads.append(Thread(channel=t["channel"], thread_ts=t["thread_ts"], root=root, replies=replies))
@@ -184,9 +233,11 @@ def main(argv: Optional[List[str]] = None) -> int:
     p = argparse.ArgumentParser(description="Rebuild Slack threads from export and optionally run an extractor.")
     p.add_argument("export_dir", type=Path, help="Path to Slack export root directory")
     p.add_argument("--list", action="store_true", help="Print a human-readable summary of threads")
-    p.add_argument("--out", type=Path, help="Write the output as json")
-    p.add_argument("--extract", action="store_true", help="Run LLM/qa_extractor.extract_qas on each thread and emit results JSONL")
+    p.add_argument("--out", type=Path, help="Write the output as json (extracted Q&As with --extract, otherwise the threads)")
+    p.add_argument("--extract", action="store_true", help="Run LLM/qa_extractor.extract_qas on each thread; writes Q&As to --out (checkpointed to <out>.partial.jsonl while running), or results JSONL to stdout")
     p.add_argument("--model", default="gpt-4o-mini", help="Model to use with --extract")
+    p.add_argument("--workers", type=int, default=1, help="Processes used to parse export files (default: 1 = in-process; try it on multi-core machines with large exports)")
+    p.add_argument("--concurrency", type=int, default=8, help="Threads sent to the extractor at once with --extract (default: 8)")
 
     args = p.parse_args(argv)
 
@@ -195,7 +246,8 @@ def main(argv: Optional[List[str]] = None) -> int:
         print(f"Error: {export_root} is not a directory", file=sys.stderr)
         return 2
 
-    messages = load_all_messages(export_root)
+    # Only threads are used below, so unthreaded messages are never materialized
+    messages = load_all_messages(export_root, workers=args.workers, threads_only=True)
     threads = build_threads(messages)
 
     if args.list:
@@ -221,48 +273,60 @@ def main(argv: Optional[List[str]] = None) -> int:
             print(e, file=sys.stderr)
             return 3
 
-        out_path = Path("tmp.json")
-        with out_path.open("w", encoding="utf-8") as f:
-            count = 0
-            for th in threads:
-                    thread_text = thread_to_llm_text(th)
-                    try:
-                        result = extract_qas(thread_text, model=args.model)
-                        #print (count)
-                    except Exception as e:
-                        print(f"Extractor failed for thread {th.thread_ts}: {e}", file=sys.stderr)
-                        continue
-                    f.write(json.dumps(result, ensure_ascii=False) + "\n")
-                    #print(json.dumps(result, ensure_ascii=False))
-                    #print (count ,"is done")
-                    count += 1
-        print(f"Wrote {count} extraction results to {out_path}")
+        # LLM calls are network-bound, so keep several in flight. Each result is
+        # appended to a JSONL sink as soon as it lands (stdout, or a checkpoint next
+        # to --out), so a crash or Ctrl-C keeps the calls already paid for.
+        checkpoint = args.out.with_name(args.out.name + ".partial.jsonl") if args.out else None
+        sink = checkpoint.open("ab") if checkpoint else sys.stdout.buffer
+        results: List[Optional[dict]] = [None] * len(threads)
+        pool = ThreadPoolExecutor(max_workers=args.concurrency)
+        try:
+            futures = {
+                pool.submit(extract_qas, thread_to_llm_text(th), model=args.model): i
+                for i, th in enumerate(threads)
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Extractor failed for thread {threads[i].thread_ts}: {e}", file=sys.stderr)
+                    continue
+                results[i] = result
+                if checkpoint is None or result['qas'] != []:
+                    sink.write(_json_dumps(result) + b"\n")
+                    sink.flush()
+        except BaseException:
+            # Ctrl-C / fatal error: drop the queued threads instead of waiting for all of them
+            pool.shutdown(wait=False, cancel_futures=True)
+            if checkpoint:
+                print(f"Interrupted; results so far are in {checkpoint}", file=sys.stderr)
+            raise
+        finally:
+            if checkpoint:
+                sink.close()
+        pool.shutdown()
+        extracted = [r for r in results if r is not None]
+        print(f"Extracted {len(extracted)} of {len(threads)} threads", file=sys.stderr)
 
 
     if args.out:
-        #all_threads = [thread_to_minimal_dict(th) for th in threads]
-        #with args.out.open("w", encoding="utf-8") as f:
-            #json.dump(all_threads, f, indent=2, ensure_ascii=False)
-        #print(f"Wrote {len(all_threads)} threads to {args.out} (JSON array)")
-
-        data = []
-        input_file = "tmp.json"
-        output_file = args.out
-
-        # Read JSONL file line by line
-        with open(input_file, "r", encoding="utf-8") as f:
-            for line in f:
-                item=json.loads(line.strip())
-                if item['qas'] != []:
-                   data.append(json.loads(line.strip()))
+        if args.extract:
+            # Only threads that yielded at least one Q&A go into the FAQ file, in thread order
+            data = [r for r in extracted if r['qas'] != []]
+        else:
+            data = [thread_to_minimal_dict(th) for th in threads]
 
-        with open(output_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        with args.out.open("wb") as f:
+            f.write(_json_dumps(data, indent=True))
+        print(f"Wrote {len(data)} items to {args.out} (JSON array)")
+        if args.extract:
+            checkpoint.unlink(missing_ok=True)
 
 
 
     if not (args.list or args.out or args.extract):
-        print("Loaded messages:", len(messages))
+        print("Loaded threaded messages:", len(messages))
         print("Reconstructed threads:", len(threads))
         print("Use --list, --out, or --extract for actions.")
 